@@ -0,0 +1,67 @@
+import time
+
+# Per-request limits on the work done for one s(CASP) response, so that one
+# huge or malformed response can't tie up a worker.
+#
+# The checks are cooperative: responseparser and treetransform call them at
+# stage boundaries and between answers, and stop early when the budget runs
+# out, keeping what they have done so far. A single answer that is already
+# being parsed or linearised is not interrupted.
+
+class Budget:
+    """Limits for one request. None means no limit.
+       maxBytes    size of the response text (characters for str, bytes for files)
+       maxAnswers  number of answers parsed and explained
+       maxAtoms    number of atoms kept per model, conclusion included,
+                   so at least 1
+       seconds     wall-clock time, counted from the creation of the budget
+    """
+
+    def __init__(self, maxBytes=None, maxAnswers=None, maxAtoms=None, seconds=None):
+        if maxAtoms is not None and maxAtoms < 1:
+            raise Exception("Budget: maxAtoms must be at least 1 to keep the conclusion, got", maxAtoms)
+        self.maxBytes = maxBytes
+        self.maxAnswers = maxAnswers
+        self.maxAtoms = maxAtoms
+        self.deadline = None if seconds is None else time.monotonic() + seconds
+        self.truncated = False
+        self.reasons = []
+
+    def truncate(self, reason):
+        self.truncated = True
+        if reason not in self.reasons:
+            self.reasons.append(reason)
+
+    def expired(self):
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self.truncate('deadline')
+            return True
+        return False
+
+    def allowsHeader(self, end):
+        """Whether the part of the response before the first answer,
+           which ends at offset end, can be parsed.
+        """
+        if self.maxBytes is not None and end > self.maxBytes:
+            self.truncate('bytes')
+            return False
+        return not self.expired()
+
+    def allowsAnswer(self, count, end):
+        """Whether another answer can be parsed, when count answers are done
+           and the next one ends at offset end.
+        """
+        if self.maxAnswers is not None and count >= self.maxAnswers:
+            self.truncate('answers')
+            return False
+        if self.maxBytes is not None and end > self.maxBytes:
+            self.truncate('bytes')
+            return False
+        return not self.expired()
+
+    def clipModel(self, model):
+        """Clips a model, or the list of atoms of a parsed answer, to maxAtoms."""
+        if self.maxAtoms is not None and len(model) > self.maxAtoms:
+            self.truncate('atoms')
+            return model[:self.maxAtoms]
+        return model
@@ -0,0 +1,153 @@
+import gc
+import math
+import sys
+import time
+import gf_python.responseparser as rp
+import gf_python.treetransform as tt
+
+# Complexity regression tests.
+# For each stage, we generate legal but unusual inputs of growing size along
+# one dimension, time the stage, and fit the exponent k in time ~ size^k by
+# least squares on the log-log timings. A case fails when k exceeds the
+# exponent declared for it, so blow-ups show up before they hit production.
+#
+# python -m gf_python.complexity_test              runs all cases
+# python -m gf_python.complexity_test deep_terms   runs the named cases
+
+TOLERANCE = 0.25 # timings are noisy, allow this much over the declared exponent
+REPEATS = 3     # the fastest of this many runs is used for each size
+
+#### Input generators
+## Each returns an s(CASP) snippet of the given size along one dimension.
+
+def answerText(n, justification="", model="{ win(A,RPS) }", bindings=""):
+    return "\n".join([
+        "        ANSWER: %d (in 0.091 ms)" % n,
+        "",
+        "JUSTIFICATION_TREE:",
+        justification + "global_constraint.",
+        "",
+        "MODEL:",
+        model,
+        "",
+        "BINDINGS:",
+        bindings,
+        ""])
+
+def longModel(n):
+    atoms = ["is_player(p%d)" % i for i in range(n)]
+    return answerText(1, model="{ " + ",  ".join(atoms) + " }")
+
+def deepTerm(n):
+    term = "a"
+    for _ in range(n):
+        term = "f(" + term + ",b)"
+    return term
+
+def deepJustification(n):
+    lines = []
+    for i in range(n):
+        lines.append("    "*i + "is_player(p%d) :-" % i)
+    lines.append("    "*n + "is_game(rps).")
+    return answerText(1, justification="\n".join(lines) + "\n")
+
+def manyDisunities(n):
+    constraints = ",".join("P \\= c%d" % i for i in range(n))
+    return answerText(1, model="{ is_player(P | {" + constraints + "}) }")
+
+def manyAnswers(n):
+    return "QUERY:?- win(A,RPS).\n\n" + "\n".join(answerText(i+1) for i in range(n))
+
+def deepIndentation(n):
+    # Up one level per line, then down one level per line.
+    levels = list(range(n)) + list(range(n-2, -1, -1))
+    return "\n".join(" "*l + "x" for l in levels)
+
+def longEvidence(n):
+    # Two models that share n+1 atoms and differ in n+1 atoms
+    def atom(a):
+        return tt.pgf.readExpr(a)
+    def app(pred, subj, obj=None):
+        if obj is None:
+            return tt.R.App(tt.R.IntransPred(atom(pred)), subj)
+        return tt.R.App(tt.R.TransPred(atom(pred), obj), subj)
+    players = [tt.R.AVar(tt.R.V(atom('"P%d"' % i))) for i in range(n)]
+    rps = tt.R.AVar(tt.R.V(atom('"RPS"')))
+    shared = [app("win", players[0]), app("is_game", rps)] + [app("is_player", p) for p in players]
+    def unique(sign, beaten):
+        s = tt.R.AAtom(atom(sign))
+        return [app("beat", s, tt.R.AAtom(atom(beaten)))] + [app("throw", p, s) for p in players]
+    return [shared + unique("rock", "scissors"),
+            shared + unique("paper", "rock")]
+
+def longArgList(n):
+    return [tt.R.AVar(tt.R.V(tt.pgf.readExpr('"P%d"' % i))) for i in range(n)]
+
+#### Cases
+## name: (input generator, stage, sizes, declared exponent)
+## Sizes are those of the generated dimension, not the length of the input:
+## indentation makes deep input grow with the square of its depth.
+## Nested input goes up to the deepest nesting the parser declares it handles
+## (the innermost term of a justification adds a level).
+
+NESTING_SIZES = [rp.MAX_NESTING//8, rp.MAX_NESTING//4, rp.MAX_NESTING//2, rp.MAX_NESTING-1]
+
+cases = {
+    'long_model':         (longModel, rp.parse_answer, [100, 200, 400, 800], 1),
+    'deep_terms':         (deepTerm, lambda t: rp.parse_deep(rp.term, t), NESTING_SIZES, 1),
+    'deep_justification': (deepJustification, rp.parse_answer, NESTING_SIZES, 1),
+    'many_disunities':    (manyDisunities, rp.parse_answer, [50, 100, 200, 400], 1),
+    'many_answers':       (manyAnswers, lambda t: rp.response.parseString(rp.annotate_indents(t),True), [25, 50, 100, 200], 1),
+    'deep_indentation':   (deepIndentation, rp.annotate_indents, [500, 1000, 2000, 4000], 2), # n^2 characters
+    'list_generic':       (longArgList, tt.listArg, [250, 500, 1000, 2000], 1),
+    'long_evidence':      (longEvidence, lambda ms: tt.clearAggregateCache() or tt.nlgModels(ms), [100, 200, 400, 800], 1),
+    'deep_proof':         (deepJustification, lambda t: tt.justification2proof(rp.parse_answer(t)['justification']), NESTING_SIZES, 1),
+}
+
+def timeStage(stage, inp):
+    # As in timeit, the garbage collector is off while timing: its full
+    # collections walk every live object, which adds noise that grows with n.
+    best = None
+    for _ in range(REPEATS):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            stage(inp)
+            t = time.perf_counter() - start
+        finally:
+            gc.enable()
+        best = t if best is None else min(best, t)
+    return best
+
+def growthExponent(sizes, times):
+    """Least squares slope of log(time) against log(size)."""
+    xs = [math.log(s) for s in sizes]
+    ys = [math.log(max(t, 1e-9)) for t in times]
+    mx, my = sum(xs)/len(xs), sum(ys)/len(ys)
+    return sum((x-mx)*(y-my) for x, y in zip(xs, ys)) / sum((x-mx)**2 for x in xs)
+
+def runCase(name):
+    generate, stage, sizes, declared = cases[name]
+    times = []
+    for n in sizes:
+        inp = generate(n)
+        try:
+            times.append(timeStage(stage, inp))
+        except RecursionError:
+            print("%-20s FAIL  (recursion limit reached at size %d)" % (name, n))
+            return False
+    k = growthExponent(sizes, times)
+    ok = k <= declared + TOLERANCE
+    print("%-20s declared n^%d, measured n^%.2f  %s  (%s)" % (
+        name, declared, k, "ok" if ok else "FAIL",
+        ', '.join("%d: %.4fs" % st for st in zip(sizes, times))))
+    return ok
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(cases)
+    failed = [name for name in names if not runCase(name)]
+    if failed:
+        print("complexity_test: exceeded declared complexity: " + ', '.join(failed))
+        sys.exit(1)
+    print("complexity_test: all cases within declared complexity")
@@ -0,0 +1,104 @@
+# asyncio interface to the NLG pipeline.
+#
+# Parsing and NLG take hundreds of milliseconds on big responses, so they run
+# in an executor instead of on the event loop. A request runs two of the
+# stages from pipeline.py, parsing and then models or NLG. Their inputs and
+# outputs can be pickled, so a ProcessPoolExecutor works as well as the
+# default thread pool.
+#
+# Cancelling a request takes effect between the stages. Identical requests
+# (same grammar, options and response text) that are in flight at the same
+# time are computed only once.
+#
+# Usage:
+#
+#   text = await nlgModelsAsync(responsetext, "AnswerTop.pgf")
+#
+# or, to configure the executor and the number of requests in flight:
+#
+#   runner = AsyncNLG(executor=ProcessPoolExecutor(4), maxInFlight=8)
+#   text = await runner.nlgModels(responsetext, "AnswerTop.pgf", clustered=True)
+
+import asyncio
+import hashlib
+import json
+import os
+import weakref
+from gf_python.pipeline import parseStage, modelsStage, nlgStage
+
+DEFAULT_MAX_IN_FLIGHT = 4
+
+####################################
+## Async API
+
+class AsyncNLG:
+    """Runs the pipeline stages in executor (None for the event loop's default),
+       with at most maxInFlight requests being worked on at a time.
+    """
+
+    def __init__(self, executor=None, maxInFlight=DEFAULT_MAX_IN_FLIGHT):
+        self.executor = executor
+        self.maxInFlight = maxInFlight
+        self.started = 0 # number of requests actually computed
+        # Semaphores and tasks belong to an event loop
+        self.loops = weakref.WeakKeyDictionary()
+
+    def loopState(self):
+        loop = asyncio.get_running_loop()
+        state = self.loops.get(loop)
+        if state is None:
+            state = self.loops[loop] = {
+                'semaphore': asyncio.Semaphore(self.maxInFlight),
+                'inFlight': {}}
+        return loop, state
+
+    async def parseModels(self, responsetext, pgfPath, **options):
+        """Async version of treetransform.parseModels."""
+        return await self.shared(modelsStage, responsetext, pgfPath, options)
+
+    async def nlgModels(self, responsetext, pgfPath, **options):
+        """Parses the response and explains its models. Options are as in nlgserver."""
+        return await self.shared(nlgStage, responsetext, pgfPath, options)
+
+    async def run(self, lastStage, responsetext, pgfPath, options):
+        loop, state = self.loopState()
+        async with state['semaphore']:
+            self.started += 1
+            answers = await loop.run_in_executor(self.executor, parseStage, responsetext, options)
+            return await loop.run_in_executor(self.executor, lastStage, pgfPath, answers, options)
+
+    async def shared(self, lastStage, responsetext, pgfPath, options):
+        """Runs the stages, sharing the result with identical requests in flight.
+           The shared computation is cancelled when all of its callers are.
+        """
+        key = (lastStage.__name__,
+               os.path.abspath(pgfPath),
+               json.dumps(options, sort_keys=True),
+               hashlib.sha256(responsetext.encode('utf-8')).hexdigest())
+        _, state = self.loopState()
+        inFlight = state['inFlight']
+
+        entry = inFlight.get(key)
+        if entry is None:
+            task = asyncio.ensure_future(self.run(lastStage, responsetext, pgfPath, options))
+            entry = inFlight[key] = {'task': task, 'waiting': 0}
+            def forget(_, entry=entry):
+                if inFlight.get(key) is entry:
+                    del inFlight[key]
+            task.add_done_callback(forget)
+
+        entry['waiting'] += 1
+        try:
+            return await asyncio.shield(entry['task'])
+        finally:
+            entry['waiting'] -= 1
+            if entry['waiting'] == 0 and not entry['task'].done():
+                entry['task'].cancel()
+
+defaultRunner = AsyncNLG()
+
+async def parseModelsAsync(responsetext, pgfPath, **options):
+    return await defaultRunner.parseModels(responsetext, pgfPath, **options)
+
+async def nlgModelsAsync(responsetext, pgfPath, **options):
+    return await defaultRunner.nlgModels(responsetext, pgfPath, **options)
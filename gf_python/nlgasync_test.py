@@ -0,0 +1,52 @@
+import asyncio
+import concurrent.futures
+import gf_python.nlgasync as nlgasync
+import gf_python.treetransform as tt
+
+#### Test data
+
+pgfPath = tt.localFile("AnswerTop.pgf")
+rawResponse = open(tt.localFile("test-model.txt"), 'r').read()
+
+gold = tt.nlgModels(tt.parseModels(tt.responsetext))
+
+################# TESTS #################
+
+async def identicalRequestsShareWork():
+    runner = nlgasync.AsyncNLG(maxInFlight=2)
+    results = await asyncio.gather(*[runner.nlgModels(rawResponse, pgfPath) for _ in range(10)])
+    assert results == [gold]*10
+    assert runner.started == 1
+
+    # Once done, the same request is computed again
+    assert await runner.nlgModels(rawResponse, pgfPath) == gold
+    assert runner.started == 2
+
+async def cancelledRequestsStop():
+    runner = nlgasync.AsyncNLG(maxInFlight=1)
+    first = asyncio.ensure_future(runner.nlgModels(rawResponse, pgfPath))
+    queued = asyncio.ensure_future(runner.nlgModels(rawResponse, pgfPath, clustered=True))
+    await asyncio.sleep(0)
+    queued.cancel()
+    assert await first == gold
+    try:
+        await queued
+    except asyncio.CancelledError:
+        pass
+    else:
+        assert False, "expected the request to be cancelled"
+    assert runner.started == 1
+
+async def processExecutor():
+    with concurrent.futures.ProcessPoolExecutor(2) as pool:
+        runner = nlgasync.AsyncNLG(executor=pool)
+        assert await runner.nlgModels(rawResponse, pgfPath) == gold
+        models = await runner.parseModels(rawResponse, pgfPath)
+        assert [tt.show(m) for m in models] == [tt.show(m) for m in tt.parseModels(tt.responsetext)]
+
+if __name__ == "__main__":
+    asyncio.run(identicalRequestsShareWork())
+    asyncio.run(cancelledRequestsStop())
+    asyncio.run(processExecutor())
+    assert asyncio.run(nlgasync.nlgModelsAsync(rawResponse, pgfPath)) == gold
+    print("nlgasync: all tests passed")
@@ -0,0 +1,193 @@
+# A long-running NLG server. Importing the modules, reading the PGF and
+# building the pyparsing grammar happen once per worker process, so that a
+# request only pays for parsing the s(CASP) response and the NLG itself.
+
+# The protocol is JSON lines over a Unix domain socket. A client sends one
+# request per line:
+#
+#   {"pgf": "/path/to/AnswerTop.pgf", "response": "<s(CASP) output>", "options": {}}
+#
+# and gets one line back for every request, in order:
+#
+#   {"ok": true, "result": "<explanation>"}
+#   {"ok": false, "error": "<message>"}
+#
+# Options:
+#   annotated    the response has already been through annotate_indents
+#   clustered    explain with nlgModelsClustered instead of nlgModels
+#   maxClusters  cap on the number of clusters, when clustered
+
+# To start a server, and to send it a request from the command line:
+#
+# python -m gf_python.nlgserver serve /tmp/gf-nlg.sock --workers 4
+# python -m gf_python.nlgserver request /tmp/gf-nlg.sock AnswerTop.pgf test-model.txt
+
+import argparse
+import concurrent.futures
+import json
+import os
+import socket
+import socketserver
+import stat
+import sys
+import tempfile
+import threading
+from concurrent.futures.process import BrokenProcessPool
+from gf_python.pipeline import explain
+
+DEFAULT_WORKERS = 4
+
+####################################
+## Work done in the worker processes
+
+def warmUp():
+    # Runs once in every worker process: reads the default grammar and
+    # builds the parser before the first request arrives.
+    import gf_python.treetransform
+
+####################################
+## Server
+
+class NLGRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            reply = self.server.process(line)
+            self.wfile.write(json.dumps(reply).encode('utf-8') + b"\n")
+            self.wfile.flush()
+
+class NLGServer(socketserver.ThreadingUnixStreamServer):
+    """Accepts connections on a Unix socket, and hands the requests to a
+       bounded pool of worker processes. At most maxPending requests are
+       queued at a time; connections beyond that wait for a free slot.
+    """
+    daemon_threads = True
+
+    def __init__(self, socketPath, workers=DEFAULT_WORKERS, maxPending=None):
+        removeStaleSocket(socketPath)
+        super().__init__(socketPath, NLGRequestHandler)
+        self.socketPath = socketPath
+        self.workers = workers
+        self.pool = concurrent.futures.ProcessPoolExecutor(workers, initializer=warmUp)
+        self.poolLock = threading.Lock()
+        self.pending = threading.BoundedSemaphore(maxPending or 2*workers)
+
+    def replacePool(self, broken):
+        """Starts a new pool in place of broken, unless another thread already did.
+           A pool is broken for good when one of its workers dies.
+        """
+        with self.poolLock:
+            if self.pool is broken:
+                self.pool = concurrent.futures.ProcessPoolExecutor(self.workers, initializer=warmUp)
+                broken.shutdown(wait=False, cancel_futures=True)
+
+    def process(self, line):
+        try:
+            req = json.loads(line)
+            args = (req['pgf'], req['response'], req.get('options', {}))
+        except (ValueError, KeyError, TypeError) as err:
+            return {'ok': False, 'error': "malformed request: %s" % err}
+        with self.pending:
+            pool = self.pool
+            try:
+                return {'ok': True, 'result': pool.submit(explain, *args).result()}
+            except BrokenProcessPool:
+                self.replacePool(pool)
+                return {'ok': False, 'error': "a worker process died, try again"}
+            except Exception as err:
+                return {'ok': False, 'error': ' '.join(str(a) for a in err.args) or repr(err)}
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(cancel_futures=True)
+        if os.path.exists(self.socketPath):
+            os.unlink(self.socketPath)
+
+def removeStaleSocket(socketPath):
+    """Removes a socket left behind by a server that is gone. Raises if
+       socketPath is something else, or if a server still answers on it.
+    """
+    try:
+        mode = os.stat(socketPath).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise Exception("nlgserver: %s exists and is not a socket" % socketPath)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(socketPath)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.unlink(socketPath)
+            return
+    raise Exception("nlgserver: a server is already listening on %s" % socketPath)
+
+def serve(socketPath, workers=DEFAULT_WORKERS):
+    with NLGServer(socketPath, workers) as server:
+        server.serve_forever()
+
+def startLocal(workers=2):
+    """Starts a server on a fresh socket in a background thread, for tests.
+       Returns the server; call stopLocal(server) when done.
+    """
+    socketPath = os.path.join(tempfile.mkdtemp(), "gf-nlg.sock")
+    server = NLGServer(socketPath, workers)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def stopLocal(server):
+    server.shutdown()
+    server.server_close()
+    os.rmdir(os.path.dirname(server.socketPath))
+
+####################################
+## Client
+
+def request(socketPath, pgfPath, responsetext, **options):
+    """Sends one request to the server at socketPath, and returns the explanation."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(socketPath)
+        with s.makefile('rwb') as f:
+            req = {'pgf': os.path.abspath(pgfPath), 'response': responsetext, 'options': options}
+            f.write(json.dumps(req).encode('utf-8') + b"\n")
+            f.flush()
+            line = f.readline()
+    if not line:
+        raise Exception("nlgserver: the server closed the connection without replying")
+    reply = json.loads(line)
+    if not reply['ok']:
+        raise Exception("nlgserver: " + reply['error'])
+    return reply['result']
+
+####################################
+## Command line
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="gf-nlg", description="Warm NLG server for s(CASP) responses")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serveCmd = commands.add_parser('serve', help="run the server")
+    serveCmd.add_argument('socket')
+    serveCmd.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+
+    requestCmd = commands.add_parser('request', help="explain a response file with a running server")
+    requestCmd.add_argument('socket')
+    requestCmd.add_argument('pgf')
+    requestCmd.add_argument('response')
+    requestCmd.add_argument('--clustered', action='store_true')
+    requestCmd.add_argument('--max-clusters', type=int, default=8)
+
+    args = parser.parse_args(argv)
+    if args.command == 'serve':
+        serve(args.socket, args.workers)
+    else:
+        with open(args.response, 'r') as f:
+            responsetext = f.read()
+        options = {}
+        if args.clustered:
+            options = {'clustered': True, 'maxClusters': args.max_clusters}
+        print(request(args.socket, args.pgf, responsetext, **options))
+
+if __name__=="__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+import concurrent.futures
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import time
+import gf_python.nlgserver as nlgserver
+import gf_python.treetransform as tt
+
+#### Test data
+
+pgfPath = tt.localFile("AnswerTop.pgf")
+rawResponse = open(tt.localFile("test-model.txt"), 'r').read()
+
+gold = tt.nlgModels(tt.parseModels(tt.responsetext))
+
+################# TESTS #################
+## Start a server locally, and send it requests over its socket.
+
+if __name__ == "__main__":
+    server = nlgserver.startLocal(workers=2)
+    try:
+        sock = server.socketPath
+
+        assert nlgserver.request(sock, pgfPath, rawResponse) == gold
+        assert nlgserver.request(sock, pgfPath, tt.responsetext, annotated=True) == gold
+
+        # Concurrent requests all get their own answer
+        with concurrent.futures.ThreadPoolExecutor(8) as clients:
+            results = list(clients.map(
+                lambda _: nlgserver.request(sock, pgfPath, rawResponse), range(16)))
+        assert results == [gold]*16
+
+        # Errors are reported back, and the server keeps going
+        try:
+            nlgserver.request(sock, pgfPath, "not an s(CASP) response")
+        except Exception as err:
+            assert str(err).startswith("nlgserver:")
+        else:
+            assert False, "expected an error for a malformed response"
+        assert nlgserver.request(sock, pgfPath, rawResponse) == gold
+
+        # A second server doesn't take over the socket of a live one
+        try:
+            nlgserver.NLGServer(sock, workers=1)
+        except Exception as err:
+            assert "already listening" in str(err)
+        else:
+            assert False, "expected an error for a socket in use"
+        assert nlgserver.request(sock, pgfPath, rawResponse) == gold
+
+        # The server recovers when a worker process dies
+        brokenPool = server.pool
+        os.kill(next(iter(brokenPool._processes)), signal.SIGKILL)
+        for _ in range(50):
+            try:
+                assert nlgserver.request(sock, pgfPath, rawResponse) == gold
+            except Exception as err:
+                assert "worker process died" in str(err)
+            if server.pool is not brokenPool:
+                break
+            time.sleep(0.1)
+        assert server.pool is not brokenPool
+        assert nlgserver.request(sock, pgfPath, rawResponse) == gold
+    finally:
+        nlgserver.stopLocal(server)
+
+    # Only stale sockets are removed, never other files
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, "gf-nlg.sock")
+        with open(path, 'w') as f:
+            f.write("not a socket")
+        try:
+            nlgserver.NLGServer(path, workers=1)
+        except Exception as err:
+            assert "not a socket" in str(err)
+        else:
+            assert False, "expected an error for a regular file"
+        assert os.path.exists(path)
+        os.unlink(path)
+
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(path)
+        stale.close() # the socket file stays, nobody listens on it
+        server = nlgserver.NLGServer(path, workers=1)
+        server.server_close()
+    finally:
+        shutil.rmtree(tmpdir)
+    print("nlgserver: all tests passed")
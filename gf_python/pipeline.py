@@ -0,0 +1,41 @@
+# The stages of the NLG pipeline, shared by nlgserver and nlgasync.
+#
+#   parseStage   s(CASP) response text -> answer dicts from responseparser
+#   modelsStage  answer dicts -> models, as from treetransform.parseModels
+#   nlgStage     answer dicts -> explanation text
+#
+# Their inputs and outputs can be pickled, so they can run in worker
+# processes as well as threads. Options are as in nlgserver.
+# The modules are imported when a stage first runs, so that importing this
+# module doesn't read the grammar.
+
+import threading
+
+# treetransform keeps the current grammar in module globals, so threads
+# take turns at the stages that need a grammar.
+grammarLock = threading.Lock()
+
+def parseStage(responsetext, options):
+    import gf_python.responseparser as rp
+    if not options.get('annotated', False):
+        responsetext = rp.annotate_indents(responsetext)
+    return rp.parse_deep(rp.response, responsetext)['answer set']
+
+def modelsStage(pgfPath, answers, options):
+    import gf_python.treetransform as tt
+    with grammarLock:
+        tt.useGrammar(pgfPath)
+        return [tt.answer2model(ans) for ans in answers]
+
+def nlgStage(pgfPath, answers, options):
+    import gf_python.treetransform as tt
+    with grammarLock:
+        tt.useGrammar(pgfPath)
+        models = [tt.answer2model(ans) for ans in answers]
+        if options.get('clustered', False):
+            return tt.nlgModelsClustered(models, options.get('maxClusters', 8))
+        return tt.nlgModels(models)
+
+def explain(pgfPath, responsetext, options):
+    """Runs all stages in the current thread."""
+    return nlgStage(pgfPath, parseStage(responsetext, options), options)
@@ -13,6 +13,13 @@
 # responsetext = responsefile.read()
 # print(yaml.dump(response.parseString(responsetext,True).asDict()))
 
+# For very large responses stored on disk, use iter_answers_file(filename)
+# instead, which never reads the whole file into a string and yields the
+# parsed answers one at a time, so memory use doesn't grow with the file.
+# parse_response_file(filename) also avoids reading the file into a string,
+# but returns all parsed answers at once, which take tens of times the size
+# of the file.
+
 # YAML is the easiest way to visualize the resulting parse trees.
 # pyparsing's internal display methods contain too much redudant information
 # to be legible for large trees.
@@ -27,7 +34,14 @@
 
 import pyparsing as pp
 from pyparsing import *
+import concurrent.futures
+import itertools
+import mmap
+import os
+import re
 import string
+import sys
+import threading
 import yaml
 
 
@@ -69,50 +83,56 @@ def test(description,object,string,should_parse=True):
                 print(message)
 
 def annotate_indents(code):
+    return "\n".join(indent_lines(code.splitlines(), STR_TOKENS))
 
-    UPINDENT = "{{UP}}"
-    DOWNINDENT = "{{DOWN}}"
+# The tokens used by indent_lines, as str and as bytes:
+# (answer tag, space, newline, up indent marker, down indent marker)
+STR_TOKENS = ("ANSWER:", " ", "\n", "{{UP}}", "{{DOWN}}")
+BYTES_TOKENS = tuple(t.encode('ascii') for t in STR_TOKENS)
 
-    # First, turn the code into a list of tuples, for the code and the number of prepended spaces
-    # This shouldn't be required if we take tokens from the parser?
-    lines = code.splitlines()
-    annotated_lines = []
-    for l in lines:
-        if not l.lstrip().startswith("ANSWER:"):
-            spaces = len(l) - len(l.lstrip(' '))
-        else:
-            spaces = 0
-        annotated_lines.append((l,spaces))
+def indent_lines(lines, tokens, close=False):
+    """Yields the lines, with up and down indent markers inserted where the
+       indentation changes. Works on str or bytes lines, given matching tokens.
+       If close is True, the levels still open at the end are closed, as they
+       would be by a following ANSWER: line.
+    """
+    answer_tag, space, _, up, down = tokens
 
-    # Second, check to see if there are any broken indentations
     levels = []
-    new_strings = []
-    for (text,l) in annotated_lines:
+    for text in lines:
+        # ANSWER: lines are always at the outermost level
+        if not text.lstrip().startswith(answer_tag):
+            l = len(text) - len(text.lstrip(space))
+        else:
+            l = 0
+
         if levels == []:
             # This is the first line, add its level.
             levels.append(l)
-            new_strings.append(text)
+            yield text
         elif l == levels[-1]:
             # This line is the same level, just add it.
-            new_strings.append(text)
+            yield text
         elif l > levels[-1]:
             # The indentation level has increased
-            new_strings.append(UPINDENT)
-            new_strings.append(text)
+            yield up
+            yield text
             levels.append(l)
         elif l < levels[-1]:
             if l in levels:
                 while l != levels[-1]:
-                    new_strings.append(DOWNINDENT)
+                    yield down
                     levels.pop()
-                new_strings.append(text)
+                yield text
             else:
                 # The indentation has gone down, but to
                 # a level of indentation not currently in
                 # the stack. Throw an error.
                 raise Exception("Unexpected indentation level.")
 
-    return "\n".join(new_strings)
+    if close:
+        for _ in levels[1:]:
+            yield down
 
 
 
@@ -131,16 +151,20 @@ atom = neg_atom | base_atom
 named_var = pp.Word(string.ascii_uppercase, pp.printables, excludeChars="(),#.:%{}=\\")("variable")
 silent_var = pp.Literal("_")('silent variable')
 variable = pp.Forward()
-symbol = atom ^ variable
+# The alternatives below never compete for the same input, or the first one
+# is always the longer match, so MatchFirst (|) gives the same parse as Or (^).
+# Or parses the winning alternative twice, which is exponential in the
+# nesting depth of terms and justifications.
+symbol = atom | variable
 argument = pp.Forward()
 argument_list = pp.Suppress(LPAREN) + pp.delimitedList(pp.Group(argument))('arguments') + pp.Suppress(RPAREN)
 constraint_op = pp.Literal(DISEQ_OP)('disequality') | pp.Literal(EQ_OP)('equality')
 constraint = Group(symbol)('left side') + Group(constraint_op)('operator') + Group(symbol)('right side')
 term = pp.Group(pp.Group(atom)('functor') + pp.Optional(argument_list))('term')
-naf_term = pp.Group(NAF + term)('negation as failure')
+naf_term = pp.Group(pp.Keyword(NAF) + term)('negation as failure')
 statement = naf_term | term | constraint
 query = pp.Suppress(QUERY_OP) + pp.Group(pp.delimitedList(pp.Group(statement)))('query') + pp.Suppress(PERIOD)
-argument <<= statement ^ variable
+argument <<= statement | variable
 
 # A query is the query prompt followed by a query.
 query_statement = pp.Literal("QUERY:") + query
@@ -184,7 +208,7 @@ list_of_reasons = pp.OneOrMore(pp.Group(reason) \
 conclusion = pp.Group(pp.Group(statement)('implication conclusion') + pp.Suppress(IMPLICATION) + UPINDENT + list_of_reasons + DOWNINDENT)
 
 # A reason is either a conclusion, or a statement.
-reason <<= pp.Group(conclusion)('implication reason') ^ pp.Group(term)('term reason')
+reason <<= pp.Group(conclusion)('implication reason') | pp.Group(statement)('term reason')
 
 # A justification tree is JUSTIFICATION_TREE: followed by a list of reasons.
 justification = pp.Suppress(pp.Literal("JUSTIFICATION_TREE:")) + list_of_reasons
@@ -203,6 +227,275 @@ fact = pp.Group(statement + pp.Suppress(PERIOD))('fact')
 
 # A conclusion is a statement followed by an implication, followed by one or more justifications.
 
+# Deeply nested input.
+# pyparsing recurses about 20 Python frames for every level of nesting of
+# terms and justifications, so the default recursion limit gives out at
+# around 50 levels. parse_deep measures the nesting first, and parses deep
+# input in a worker thread with a larger stack, up to MAX_NESTING levels.
+# Deeper input raises RecursionError without being parsed.
+# The recursion limit and the stack size for new threads are global, so
+# they are changed once, when the worker thread starts, and the recursion
+# limit is only ever raised.
+
+MAX_NESTING = 1000
+SHALLOW_NESTING = 30 # parsed in the calling thread
+FRAMES_PER_LEVEL = 25
+DEEP_STACK_SIZE = 256 * 1024 * 1024
+
+NESTING_TOKENS = re.compile(r"[()]|\{\{UP\}\}|\{\{DOWN\}\}")
+
+deep_worker = None
+deep_worker_lock = threading.Lock()
+
+def nesting_depth(text):
+    """The deepest nesting of parentheses and indentation markers in text."""
+    depth = deepest = 0
+    for m in NESTING_TOKENS.finditer(text):
+        if m.group() in ("(", UPINDENT):
+            depth += 1
+            deepest = max(deepest, depth)
+        else:
+            depth -= 1
+    return deepest
+
+def get_deep_worker():
+    """The thread pool of one thread with a stack for MAX_NESTING levels."""
+    global deep_worker
+    with deep_worker_lock:
+        if deep_worker is None:
+            sys.setrecursionlimit(max(sys.getrecursionlimit(), MAX_NESTING * FRAMES_PER_LEVEL))
+            old_stack_size = threading.stack_size(DEEP_STACK_SIZE)
+            try:
+                deep_worker = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="parse_deep")
+                deep_worker.submit(int).result() # starts the thread with this stack size
+            finally:
+                threading.stack_size(old_stack_size)
+        return deep_worker
+
+def parse_deep(element, text):
+    """Returns element.parseString(text,True).asDict(), for input nested
+       up to MAX_NESTING levels deep.
+    """
+    depth = nesting_depth(text)
+    if depth > MAX_NESTING:
+        raise RecursionError("parse_deep: input nested %d levels deep, at most %d are supported" % (depth, MAX_NESTING))
+    if depth <= SHALLOW_NESTING:
+        return element.parseString(text,True).asDict()
+    return get_deep_worker().submit(lambda: element.parseString(text,True).asDict()).result()
+
+# Reading large responses from files.
+# Instead of reading the whole file into a string, we memory-map it, find
+# the ANSWER: lines in the raw bytes, and annotate and decode one answer at
+# a time. Only the answer being parsed is ever held as a string.
+
+def find_answer(buf, pos, tokens):
+    """Returns the offset of the first line at or after pos that starts an
+       answer, or -1. Works on str, bytes and mmap objects, given matching tokens.
+    """
+    answer_tag, _, newline, _, _ = tokens
+    while True:
+        pos = buf.find(answer_tag, pos)
+        if pos == -1:
+            return -1
+        line_start = buf.rfind(newline, 0, pos) + 1
+        if not buf[line_start:pos].strip():
+            return line_start
+        pos += len(answer_tag)
+
+def answer_spans(buf, tokens):
+    """Yields the (start, end) offsets of each answer in buf, scanning lazily."""
+    start = find_answer(buf, 0, tokens)
+    while start != -1:
+        line_end = buf.find(tokens[2], start)
+        next_start = -1 if line_end == -1 else find_answer(buf, line_end, tokens)
+        end = len(buf) if next_start == -1 else next_start
+        yield (start, end)
+        start = next_start
+
+def parse_answer(chunk):
+    """Parses the text of a single answer, as str or bytes.
+       Returns the same dict as one element of the 'answer set' of a response.
+    """
+    if isinstance(chunk, str):
+        text = "\n".join(indent_lines(chunk.splitlines(), STR_TOKENS, close=True))
+    else:
+        text = b"\n".join(indent_lines(chunk.splitlines(), BYTES_TOKENS, close=True)).decode('utf-8')
+    return parse_deep(answer, text)
+
+def iter_answers_file(path, budget=None):
+    """Yields the parsed answers of the response stored in path, one at a time.
+       With a budget (see budget.py), stops when the budget runs out.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            if hasattr(buf, 'madvise'):
+                buf.madvise(mmap.MADV_SEQUENTIAL)
+            for count, (start, end) in enumerate(answer_spans(buf, BYTES_TOKENS)):
+                if budget is not None and not budget.allowsAnswer(count, end):
+                    return
+                yield parse_answer(buf[start:end])
+                # We are done with these pages, drop them from our resident set.
+                if hasattr(buf, 'madvise'):
+                    page_start = start - start % mmap.PAGESIZE
+                    buf.madvise(mmap.MADV_DONTNEED, page_start, end - page_start)
+
+def parse_response_file(path, budget=None):
+    """Parses the response stored in path. Returns the same dict as
+       response.parseString(annotate_indents(text),True).asDict()
+       With a budget, only the answers within the budget are parsed.
+       All parsed answers are kept in memory; to process large responses
+       answer by answer, use iter_answers_file.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            raise Exception("parse_response_file: empty response file " + path)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            header_end = find_answer(buf, 0, BYTES_TOKENS)
+            if header_end == -1:
+                header_end = size
+            header = annotate_indents(buf[:header_end].decode('utf-8'))
+    if header_end == size:
+        return response.parseString(header,True).asDict()
+    result = query_statement.parseString(header,True).asDict()
+    result['answer set'] = list(iter_answers_file(path, budget))
+    return result
+
+# Parsing the answers of one large response in parallel.
+# Once the QUERY header is known, the answers are independent of each other.
+# Every answer starts at the outermost indentation level, so each chunk can
+# be annotated on its own, and closing its open levels at the end gives the
+# same markers as annotating the whole response.
+
+def parse_answer_safely(chunk):
+    """Like parse_answer, but returns (answer, None) on success, and
+       (None, error) if the answer could not be parsed.
+    """
+    try:
+        return (parse_answer(chunk), None)
+    except Exception as err:
+        return (None, {'answer number': answer_number(chunk), 'error': str(err)})
+
+def answer_number(chunk):
+    m = re.match(r"\s*ANSWER:\s*(\d+)", chunk)
+    return m.group(1) if m else None
+
+# Below this many characters of answers, starting the processes costs more
+# than it saves, and the answers are parsed in this process.
+PARALLEL_MIN_CHARS = 64 * 1024
+
+shared_pool = None
+shared_pool_lock = threading.Lock()
+
+def get_shared_pool():
+    """The process pool used by parse_response_parallel when no processes or
+       executor are given. Started on first use and kept for the next calls.
+    """
+    global shared_pool
+    with shared_pool_lock:
+        if shared_pool is None:
+            shared_pool = concurrent.futures.ProcessPoolExecutor()
+        return shared_pool
+
+def shutdown_shared_pool():
+    """Stops the shared process pool, if it was started. The next call to
+       get_shared_pool starts a new one.
+    """
+    global shared_pool
+    with shared_pool_lock:
+        if shared_pool is not None:
+            shared_pool.shutdown()
+            shared_pool = None
+
+def parse_response_parallel(responsetext, processes=None, executor=None, chunksize=8):
+    """Parses a response that has NOT been through annotate_indents, parsing
+       its answers across a pool of processes. Returns the same dict as
+       response.parseString(annotate_indents(responsetext),True).asDict(),
+       with the answers in order, and an extra 'errors' list for the answers
+       that could not be parsed. Those are left out of the 'answer set'.
+       Pass an executor to reuse an existing pool, or processes to start a
+       pool of that size for this call. Otherwise, small responses are parsed
+       serially and large ones in a pool shared between calls.
+    """
+    spans = list(answer_spans(responsetext, STR_TOKENS))
+    header_end = spans[0][0] if spans else len(responsetext)
+    header = annotate_indents(responsetext[:header_end])
+    if not spans:
+        result = response.parseString(header,True).asDict()
+        result['errors'] = []
+        return result
+    result = query_statement.parseString(header,True).asDict()
+
+    chunks = [responsetext[start:end] for start, end in spans]
+    serial = (processes == 1 or len(chunks) == 1 or
+              (processes is None and len(responsetext) - header_end < PARALLEL_MIN_CHARS))
+    if executor is not None:
+        parsed = list(executor.map(parse_answer_safely, chunks, chunksize=chunksize))
+    elif serial:
+        parsed = [parse_answer_safely(c) for c in chunks]
+    elif processes is None:
+        parsed = list(get_shared_pool().map(parse_answer_safely, chunks, chunksize=chunksize))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+            parsed = list(pool.map(parse_answer_safely, chunks, chunksize=chunksize))
+
+    result['answer set'] = [ans for ans, err in parsed if err is None]
+    result['errors'] = [err for _, err in parsed if err is not None]
+    return result
+
+
+# Parsing within a budget (see budget.py).
+# The budget is checked before each answer, and parsing stops at the first
+# answer that doesn't fit or can't be parsed, so the answers parsed are
+# always a prefix.
+
+def parse_response_budgeted(responsetext, budget):
+    """Parses a response that has NOT been through annotate_indents, answer by
+       answer, until the budget runs out. Returns the same dict as response,
+       with the answers that fit the budget, a 'truncated' flag, and an
+       'errors' list as in parse_response_parallel. If the part before the
+       first answer doesn't fit the budget or can't be parsed, there are
+       no answers.
+    """
+    truncated = {'answer set': [], 'truncated': True, 'errors': []}
+    if budget.expired():
+        return truncated
+    spans = answer_spans(responsetext, STR_TOKENS)
+    first = next(spans, None)
+    header_end = first[0] if first else len(responsetext)
+    if not budget.allowsHeader(header_end):
+        return truncated
+    try:
+        header = annotate_indents(responsetext[:header_end])
+        if first is None:
+            result = response.parseString(header,True).asDict()
+            result['truncated'] = budget.truncated
+            result['errors'] = []
+            return result
+        result = query_statement.parseString(header,True).asDict()
+    except pp.ParseBaseException as err:
+        budget.truncate('malformed')
+        truncated['errors'].append({'answer number': None, 'error': str(err)})
+        return truncated
+
+    answers = []
+    errors = []
+    for start, end in itertools.chain([first], spans):
+        if not budget.allowsAnswer(len(answers), end):
+            break
+        ans, err = parse_answer_safely(responsetext[start:end])
+        if err is not None:
+            budget.truncate('malformed')
+            errors.append(err)
+            break
+        answers.append(ans)
+    result['answer set'] = answers
+    result['truncated'] = budget.truncated
+    result['errors'] = errors
+    return result
+
 if TESTING:
     print("     --- Testing Argument ---")
     test("Good argument - var",argument,"A")
@@ -442,10 +735,23 @@ Game = testgame""")
     code = responsefile.read()
     test("Response With Disunity Constraints",response,annotate_indents(code))
 
+    print("          --- Testing Parallel Response ---")
+
+    for file in ['test-model.txt']:
+        responsefile = open(os.path.join(os.path.dirname(os.path.abspath(__file__)), file), 'r')
+        code = responsefile.read()
+        test_count += 1
+        parallel = parse_response_parallel(code, processes=2)
+        errors = parallel.pop('errors')
+        if errors == [] and parallel == response.parseString(annotate_indents(code),True).asDict():
+            pass_count += 1
+        else:
+            fail_count += 1
+            print("-----\nTest:\tParallel parse of " + file)
+            print(yaml.dump(errors))
+
 
     print("Tests Run: " + str(test_count))
     print("Passed: " + str(pass_count))
     print("Failed: " + str(fail_count))
     print("Percentage: " + str(int((pass_count/test_count)*100)) + "%")
-
-
@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import tracemalloc
+import gf_python.responseparser as rp
+
+#### Test data
+
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+modelPath = os.path.join(MODULE_DIR, "test-model.txt")
+rawResponse = open(modelPath, 'r').read()
+
+# The query header, and the first answer with its number left open
+header = rawResponse[:rawResponse.index("        ANSWER: 1")]
+answerTemplate = rawResponse[len(header):rawResponse.index("        ANSWER: 2")].replace("ANSWER: 1", "ANSWER: %d")
+
+# The second answer doesn't parse
+brokenResponse = rawResponse.replace("throw(A,scissors)", "throw(A,scissors", 1)
+
+def writeResponse(path, n):
+    """Writes a response with n answers to path, one answer at a time."""
+    with open(path, 'w') as f:
+        f.write(header)
+        for i in range(n):
+            f.write(answerTemplate % (i+1))
+
+def parseWhole(text):
+    return rp.response.parseString(rp.annotate_indents(text),True).asDict()
+
+def streamingPeak(path):
+    """Peak memory allocated while streaming the answers of path, and their number."""
+    tracemalloc.start()
+    try:
+        count = sum(1 for _ in rp.iter_answers_file(path))
+        return tracemalloc.get_traced_memory()[1], count
+    finally:
+        tracemalloc.stop()
+
+################# TESTS #################
+
+if __name__ == "__main__":
+    tmpdir = tempfile.mkdtemp()
+    try:
+        #### Reading responses from files
+
+        # Same result as parsing the whole text
+        assert rp.parse_response_file(modelPath) == parseWhole(rawResponse)
+        assert list(rp.iter_answers_file(modelPath)) == parseWhole(rawResponse)['answer set']
+
+        smallPath = os.path.join(tmpdir, "small.txt")
+        writeResponse(smallPath, 50)
+        assert rp.parse_response_file(smallPath) == parseWhole(open(smallPath).read())
+
+        # A file over many pages is streamed answer by answer, through
+        # the mmap and dropping the pages already parsed
+        largePath = os.path.join(tmpdir, "large.txt")
+        writeResponse(largePath, 1500)
+        numbers = [ans['answer number'] for ans in rp.iter_answers_file(largePath)]
+        assert numbers == [str(i+1) for i in range(1500)]
+
+        # Streaming memory doesn't grow with the number of answers
+        mediumPath = os.path.join(tmpdir, "medium.txt")
+        writeResponse(mediumPath, 250)
+        smallPeak, smallCount = streamingPeak(smallPath)
+        mediumPeak, mediumCount = streamingPeak(mediumPath)
+        assert (smallCount, mediumCount) == (50, 250)
+        assert mediumPeak < 1.5 * smallPeak, (smallPeak, mediumPeak)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    #### Parsing answers in parallel
+
+    sequential = parseWhole(rawResponse)
+    for processes in [None, 2]:
+        parallel = rp.parse_response_parallel(rawResponse, processes=processes)
+        assert parallel.pop('errors') == []
+        assert parallel == sequential
+
+        # A broken answer is reported, the others are still parsed
+        broken = rp.parse_response_parallel(brokenResponse, processes=processes)
+        assert [e['answer number'] for e in broken['errors']] == ['2']
+        assert [a['answer number'] for a in broken['answer set']] == ['1', '3']
+
+    # Large responses go to the pool that is shared between calls
+    minChars = rp.PARALLEL_MIN_CHARS
+    rp.PARALLEL_MIN_CHARS = 0
+    try:
+        assert rp.parse_response_parallel(brokenResponse)['answer set'] == broken['answer set']
+        pool = rp.get_shared_pool()
+        assert rp.parse_response_parallel(rawResponse)['answer set'] == sequential['answer set']
+        assert rp.get_shared_pool() is pool
+    finally:
+        rp.PARALLEL_MIN_CHARS = minChars
+        rp.shutdown_shared_pool()
+    assert rp.shared_pool is None
+    print("responseparser: all tests passed")
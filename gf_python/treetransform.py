@@ -1,5 +1,10 @@
 import pgf
+import collections
+import hashlib
 import itertools
+import json
+import os
+import random
 import gf_python.ttutils as ttutils
 import gf_python.responseparser as rp
 import yaml
@@ -8,16 +13,46 @@ import yaml
 ## Parsing data from s(CASP) models
 
 # We assume that the PGF file, which is constructed in baby-l4,
-# is copied to be in the same directory, or otherwise hardcoded path.
+# is copied to be in the current directory, or next to this module.
 # The name of the grammar is also always the same.
-gr = pgf.readPGF("AnswerTop.pgf")
-R = gr.embed("AnswerTop")
+# Grammars are read once and cached by path, so that a long-running
+# process can switch between grammars without reading them again.
 
-eng = gr.languages["AnswerTopEng"]
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def localFile(name):
+    """Prefers a file in the current directory, falls back to this module's directory."""
+    if os.path.exists(name):
+        return name
+    return os.path.join(MODULE_DIR, name)
+
+grammars = {}
+aggregateCaches = {}
+
+AGGREGATE_CACHE_SIZE = 1024
+
+def newAggregateCache(maxsize=AGGREGATE_CACHE_SIZE):
+    return {'entries': collections.OrderedDict(), 'maxsize': maxsize, 'hits': 0, 'misses': 0}
+
+def loadGrammar(pgfPath):
+    """Returns the (pgf, embedded module, English concrete) triple for pgfPath."""
+    key = os.path.abspath(pgfPath)
+    if key not in grammars:
+        g = pgf.readPGF(key)
+        grammars[key] = (g, g.embed("AnswerTop"), g.languages["AnswerTopEng"])
+    return grammars[key]
+
+def useGrammar(pgfPath):
+    """Makes the functions in this module use the grammar in pgfPath."""
+    global gr, R, eng, aggrCache
+    gr, R, eng = loadGrammar(pgfPath)
+    aggrCache = aggregateCaches.setdefault(os.path.abspath(pgfPath), newAggregateCache())
+
+useGrammar(localFile("AnswerTop.pgf"))
 
 ### This file probably shouldn't be called test-model.txt and be in the same directory.
 ## TODO: find out where to read the s(CASP) responses
-responsefile = open('test-model.txt', 'r')
+responsefile = open(localFile('test-model.txt'), 'r')
 responsetext = rp.annotate_indents(responsefile.read())
 
 def mkApp(args):
@@ -35,6 +70,8 @@ def mkApp(args):
     return appExpr
 
 def term2exp(term):
+    if 'arguments' not in term:
+        raise Exception("term2exp: expected unary or binary function, got" + yaml.dump(term))
     functor = term['functor']['base atom']
     fun = pgf.readExpr(functor)
     args = term2args(term['arguments'])
@@ -72,21 +109,27 @@ def term2args(arguments):
     return argExprs
 
 def parseModels(responsetext):
-    models = []
-    resp = rp.response.parseString(responsetext,True).asDict()
+    resp = rp.parse_deep(rp.response, responsetext)
     answers = resp['answer set']
 
-    # For now, we only read models.
-    # Future work: also construct trees from justifications
-    ms = [ans['model'] for ans in answers]
-    for m in ms:
-        pgfExprs = []
-        for t in m:
-            term = t['term']
-            exp = term2exp(term)
-            pgfExprs.append(exp)
-        models.append(pgfExprs)
-    return models
+    # Here we only read models. For the justifications, see parseProofs.
+    return [answer2model(ans) for ans in answers]
+
+def parseModelsFile(path):
+    """Like parseModels, but reads the response from a file one answer at a time,
+       and yields the models one at a time, so that neither the response nor
+       all of its parsed answers are in memory at once.
+    """
+    for ans in rp.iter_answers_file(path):
+        yield answer2model(ans)
+
+def answer2model(ans):
+    pgfExprs = []
+    for t in ans['model']:
+        term = t['term']
+        exp = term2exp(term)
+        pgfExprs.append(exp)
+    return pgfExprs
 
 ####################################
 ## Translating the Haskell functions
@@ -142,6 +185,9 @@ def aggregateBySubject(exprs):
     def aggregate(es):
         preds = [ttutils.getPred(e) for e in es]
         fullExpr = es[0] # we can take any expr from group, they all have same subject
+        if fullExpr.unpack()[0] in ["App", "App1", "App2"]:
+            # AggregatePred needs a ListArg, a single subject can't be one
+            return R.ConjStatement(R.Inline, listStatement(es))
         if len(preds)==2: # GF grammar works for only two -- TODO make more generic!
             pr1, pr2 = preds
             _, args = fullExpr.unpack()
@@ -154,11 +200,62 @@ def aggregateBySubject(exprs):
 
 def aggregateAll(exprs, typography):
     """Takes a list of expressions and typography (R.Bullets or R.Inline).
-       Returns the expressions aggregated and put in a single
+       Returns the expressions aggregated and put in a single ConjStatement.
+       The result only depends on the multiset of expressions, not their
+       order, and is cached for the current grammar.
+    """
+    return wrapStatement(typography, aggregateCached(exprs))
+
+def aggregateAny(exprs, typography):
+    """Like aggregateAll, but accepts input that aggregates to fewer than
+       two statements. Returns None for empty input.
     """
-    aggr = aggregateBySubject(aggregateByPredicate(exprs))
+    if not exprs:
+        return None
+    aggr = aggregateCached(exprs)
+    if len(aggr)==1:
+        return aggr[0]
     return wrapStatement(typography, aggr)
 
+def aggregateCached(exprs):
+    """Aggregates by predicate and then by subject, through the cache."""
+    key = evidenceFingerprint(exprs)
+    entries = aggrCache['entries']
+    if key in entries:
+        aggrCache['hits'] += 1
+        entries.move_to_end(key)
+        return entries[key]
+    aggrCache['misses'] += 1
+
+    result = aggregateBySubject(aggregateByPredicate(sorted(exprs, key=show)))
+    entries[key] = result
+    if len(entries) > aggrCache['maxsize']:
+        entries.popitem(last=False)
+    return result
+
+### Cache for aggregateAll
+## The same evidence sets come up again and again, across the models of
+## one response and across interviews. There is one cache per grammar,
+## see useGrammar.
+
+def evidenceFingerprint(exprs):
+    """Order-independent fingerprint of a multiset of expressions."""
+    return hashlib.sha1('\n'.join(sorted(show(e) for e in exprs)).encode('utf-8')).digest()
+
+def aggregateCacheInfo():
+    """Returns hits, misses, current size and maximum size of the cache for the current grammar."""
+    return {'hits': aggrCache['hits'],
+            'misses': aggrCache['misses'],
+            'size': len(aggrCache['entries']),
+            'maxsize': aggrCache['maxsize']}
+
+def clearAggregateCache(maxsize=None):
+    """Empties the cache for the current grammar, optionally changing its size."""
+    aggrCache['entries'].clear()
+    aggrCache['hits'] = aggrCache['misses'] = 0
+    if maxsize is not None:
+        aggrCache['maxsize'] = maxsize
+
 
 ### Manipulate arguments to become input to aggregation funs
 
@@ -192,37 +289,441 @@ def prettyLin(e):
 ### Main function
 
 def nlgModels(models):
+    trees = nlgTrees(models)
+    _, conclusion, _ = next(trees)
+    _, aggrShared, _ = next(trees)
+    uniques = [tree for _, tree, _ in trees]
+    return formatExplanation(conclusion, aggrShared, linAlternatives(uniques))
+
+def linAlternatives(uniques):
+    """Linearises the unique evidence of the models as one disjunction.
+       Models without unique evidence (None) are left out.
+    """
+    uniques = [u for u in uniques if u is not None]
+    if len(uniques)==0:
+        return []
+    if len(uniques)==1:
+        return [prettyLin(uniques[0])]
+    return [prettyLin(R.DisjStatement(R.Bullets, listStatement(uniques)))]
+
+def formatExplanation(conclusion, aggrShared, alternatives):
+    """Lays out an explanation: the conclusion, the evidence that holds
+       in all cases (a statement, or None), and the lines that explain
+       the alternative cases (possibly none).
+    """
+    result = [prettyLin(conclusion)]
+    if aggrShared is None and not alternatives:
+        return result[0]
+    result[0] += ","
+    if aggrShared is not None:
+        result += ["\nif all of the following hold:", prettyLin(aggrShared)]
+        if alternatives:
+            result.append("\nand one of the following holds:")
+    else:
+        result.append("\nif one of the following holds:")
+    return '\n'.join(result + alternatives)
+
+def nlgTrees(models):
+    """Yields the parts of the explanation of models as (kind, tree, model indices):
+       first the conclusion, then the shared evidence, then the unique evidence
+       of each model, computed one model at a time. The tree is None for
+       evidence that is empty.
+    """
     concls = [m[0] for m in models]
     evidence = [m[1:] for m in models]
     if all(x == concls[0] for x in concls):
         conclusion = concls[0]
     else:
         raise Exception("nlgModels: expected identical conclusions, got", show(concls))
+    allModels = list(range(len(models)))
+    yield ('conclusion', conclusion, allModels)
 
-    allEvidence = [e for es in evidence for e in es] # flatten to find duplicates
-    sharedEvidence = [
-        g[0]
-        for g in aggregateBy(allEvidence)
-        if isinstance(g, list)]
-    aggrShared = aggregateAll(sharedEvidence, R.Bullets)
+    if len(models) == 1:
+        sharedEvidence = evidence[0]
+    else:
+        allEvidence = [e for es in evidence for e in es] # flatten to find duplicates
+        sharedEvidence = [
+            g[0]
+            for g in aggregateBy(allEvidence)
+            if isinstance(g, list)]
+    yield ('shared', aggregateAny(sharedEvidence, R.Bullets), allModels)
+
+    sharedSet = set(sharedEvidence) # pgf.Expr hashes by value
+    for i, es in enumerate(evidence):
+        yield ('unique', aggregateAny([e for e in es if e not in sharedSet], R.Inline), [i])
+
+### Streaming output
+## Instead of one string, the explanation comes as a sequence of events,
+## each linearised as soon as it is ready:
+##   {'event': 'conclusion' | 'shared' | 'unique',
+##    'tree': the abstract tree, 'text': its linearisation,
+##    'answers': the answer numbers it explains,
+##    'id': stable ID of the block, the same whenever its content is}
+## Parts without evidence are left out.
+
+def iterNlgModels(models, answerNumbers=None):
+    if answerNumbers is None:
+        answerNumbers = list(range(1, len(models)+1))
+    for kind, tree, indices in nlgTrees(models):
+        if tree is None:
+            continue
+        yield {'event': kind,
+               'tree': tree,
+               'text': prettyLin(tree),
+               'answers': [answerNumbers[i] for i in indices],
+               'id': hashlib.sha1((kind + ' ' + show(tree)).encode('utf-8')).hexdigest()}
+
+def eventsToJsonLines(events):
+    """Serialises events from iterNlgModels as JSON lines, one at a time."""
+    for ev in events:
+        yield json.dumps(dict(ev, tree=show(ev['tree']))) + "\n"
+
+### Explaining within a budget
+## See budget.py. When the budget runs out, we explain the answers done so
+## far instead of failing, and say that the result is truncated.
+
+def nlgModelsBudgeted(responsetext, budget):
+    """Like nlgModels(parseModels(annotate_indents(responsetext))), but stops
+       when budget runs out, or at the first answer that can't be parsed.
+       Takes the response NOT annotated. Returns a dict with the explanation
+       'text', the 'answers' it explains, whether it was 'truncated' and for
+       which 'reasons', and the parse 'errors'.
+    """
+    resp = rp.parse_response_budgeted(responsetext, budget)
+    numbers, models = [], []
+    for ans in resp.get('answer set', []):
+        if budget.expired():
+            break
+        numbers.append(int(ans['answer number']))
+        # Clip before converting, so that the atoms left out cost nothing
+        ans['model'] = budget.clipModel(ans['model'])
+        models.append(answer2model(ans))
+
+    text = ""
+    if models:
+        trees = nlgTrees(models)
+        _, conclusion, _ = next(trees)
+        _, aggrShared, _ = next(trees)
+        uniques = []
+        for _, tree, _ in trees:
+            uniques.append(tree)
+            if budget.expired():
+                break
+        numbers = numbers[:len(uniques)]
+        text = formatExplanation(conclusion, aggrShared, linAlternatives(uniques))
+
+    return {'text': text,
+            'answers': numbers,
+            'truncated': budget.truncated,
+            'reasons': list(budget.reasons),
+            'errors': resp.get('errors', [])}
 
-    uniques = [
-        aggregateAll([e for e in es if e not in sharedEvidence], R.Inline)
-        for es in evidence]
-    aggrUniques = R.DisjStatement(R.Bullets, listStatement(uniques))
+####################################
+## Clustering for large answer sets
 
-    ## Final NLG
-    result = [
-        prettyLin(conclusion) + ",",
+# nlgModels lists the unique evidence of every model, which is unreadable
+# past a few dozen models. Instead, we group models that share most of their
+# evidence, and explain each group with the evidence common to its members.
+# Similarity is estimated with MinHash signatures over interned atom IDs, and
+# models are bucketed by bands of the signature (locality-sensitive hashing),
+# so the whole thing stays linear in the number of models.
 
-        "\nif all of the following hold:",
-        prettyLin(aggrShared),
+MINHASH_PRIME = (1 << 61) - 1
 
-        "\nand one of the following holds:",
-        prettyLin(aggrUniques)
-    ]
+def internAtoms(models):
+    """Takes a list of lists of expressions.
+       Returns each list as a frozenset of atom IDs, and the list of atoms by ID.
+    """
+    ids = {}
+    atoms = []
+    atomSets = []
+    for m in models:
+        s = set()
+        for e in m:
+            k = show(e)
+            i = ids.get(k)
+            if i is None:
+                i = ids[k] = len(atoms)
+                atoms.append(e)
+            s.add(i)
+        atomSets.append(frozenset(s))
+    return atomSets, atoms
+
+def minhashSignature(atomSet, coeffs):
+    if not atomSet:
+        return tuple(-1 for _ in coeffs)
+    return tuple(
+        min((a*x + b) % MINHASH_PRIME for x in atomSet)
+        for a, b in coeffs)
+
+def jaccard(s1, s2):
+    if not s1 and not s2:
+        return 1.0
+    return len(s1 & s2) / len(s1 | s2)
+
+def clusterAtomSets(atomSets, maxClusters=8, bands=6, rows=4, seed=0):
+    """Groups atom sets into at most maxClusters clusters of similar sets.
+       Returns a list of clusters, each a list of indices into atomSets,
+       largest cluster first.
+    """
+    if maxClusters < 1:
+        raise Exception("clusterAtomSets: maxClusters must be at least 1, got", maxClusters)
+    rng = random.Random(seed)
+    coeffs = [(rng.randrange(1, MINHASH_PRIME), rng.randrange(0, MINHASH_PRIME))
+              for _ in range(bands*rows)]
+
+    # Every set joins the cluster of the first leader it shares a band with.
+    # Only leaders register their bands, so clusters don't chain together.
+    leaders = {}
+    clusters = []
+    for i, s in enumerate(atomSets):
+        sig = minhashSignature(s, coeffs)
+        keys = [(b, sig[b*rows:(b+1)*rows]) for b in range(bands)]
+        for k in keys:
+            c = leaders.get(k)
+            if c is not None:
+                clusters[c].append(i)
+                break
+        else:
+            for k in keys:
+                leaders[k] = len(clusters)
+            clusters.append([i])
+
+    clusters.sort(key=len, reverse=True)
+    kept, rest = clusters[:maxClusters], clusters[maxClusters:]
+
+    # Members of the clusters over the cap go to the most similar kept leader
+    keptLeaders = [atomSets[c[0]] for c in kept]
+    for c in rest:
+        for i in c:
+            s = atomSets[i]
+            best = max(range(len(kept)), key=lambda k: jaccard(s, keptLeaders[k]))
+            kept[best].append(i)
+    for c in kept:
+        c.sort()
+    kept.sort(key=len, reverse=True)
+    return kept
+
+def nlgModelsClustered(models, maxClusters=8, answerNumbers=None):
+    """Explains a large set of models by grouping similar models together.
+       Common evidence is factored out hierarchically: first what holds in all
+       models, then what holds in all models of a cluster.
+       Produces one aggregated block per cluster.
+    """
+    concls = [m[0] for m in models]
+    if all(x == concls[0] for x in concls):
+        conclusion = concls[0]
+    else:
+        raise Exception("nlgModelsClustered: expected identical conclusions, got", show(concls))
+    if answerNumbers is None:
+        answerNumbers = list(range(1, len(models)+1))
+
+    atomSets, atoms = internAtoms([m[1:] for m in models])
+    clusters = clusterAtomSets(atomSets, maxClusters)
+
+    commons = [frozenset.intersection(*[atomSets[i] for i in c]) for c in clusters]
+    shared = frozenset.intersection(*commons)
+
+    aggrShared = aggregateAny([atoms[i] for i in sorted(shared)], R.Bullets)
+    result = []
+    for n, (c, common) in enumerate(zip(clusters, commons), 1):
+        nums = ', '.join(str(answerNumbers[i]) for i in c[:5])
+        if len(c) > 5:
+            nums = "%d answers, including %s" % (len(c), nums)
+        else:
+            nums = "answers " + nums
+        result.append("\ncase %d (%s):" % (n, nums))
+        aggrCommon = aggregateAny([atoms[i] for i in sorted(common - shared)], R.Bullets)
+        if aggrCommon is not None:
+            result.append(prettyLin(aggrCommon))
+        elif len(c) == 1:
+            result.append("no further evidence")
+        else:
+            # The cap merged models with nothing more in common
+            result += summariseCluster(c, atomSets, atoms, shared, answerNumbers)
+    return formatExplanation(conclusion, aggrShared, result)
+
+# Bounds on the text for a cluster without common evidence, so that it
+# doesn't grow with the number of its members
+CLUSTER_TOP_ATOMS = 5
+CLUSTER_EXAMPLES = 3
+
+def summariseCluster(cluster, atomSets, atoms, shared, answerNumbers):
+    """Returns the lines that describe a cluster whose members have nothing
+       in common beyond shared: its most frequent atoms, and what a few
+       of its members add to shared.
+    """
+    result = []
+    if len(cluster) > CLUSTER_EXAMPLES:
+        counts = collections.Counter(a for i in cluster for a in atomSets[i] - shared)
+        result.append("most frequent evidence:")
+        for a, k in sorted(counts.items(), key=lambda ak: (-ak[1], ak[0]))[:CLUSTER_TOP_ATOMS]:
+            result.append("* %s (in %d of %d answers)" % (prettyLin(atoms[a]), k, len(cluster)))
+        result.append("for example:")
+    for i in cluster[:CLUSTER_EXAMPLES]:
+        aggrOwn = aggregateAny([atoms[a] for a in sorted(atomSets[i] - shared)], R.Inline)
+        own = "no further evidence" if aggrOwn is None else prettyLin(aggrOwn)
+        result.append("* answer %d: %s" % (answerNumbers[i], own))
+    rest = len(cluster) - CLUSTER_EXAMPLES
+    if rest > 0:
+        result.append("and %d other answer%s" % (rest, "" if rest == 1 else "s"))
+    return result
+
+####################################
+## Proofs from justification trees
+
+# Justification trees repeat the same sub-proofs many times: every abduced
+# premise comes with its chs/abducible chain, and the same premises show up
+# under different conclusions and in different answers. So we don't copy
+# subtrees. Each distinct sub-proof becomes one node in a DAG, identified by
+# its conclusion and the nodes of its premises, and is linearised only once.
+# The traversals are iterative, so deep proofs don't hit the recursion limit.
+#
+# The grammar has no negation, equality or nullary predicates, so conclusions
+# that are negation as failure, constraints or nullary atoms are kept as text
+# instead of GF trees, see stmt2conclusion.
+
+# Predicates that are s(CASP) bookkeeping rather than evidence
+PROOF_BOOKKEEPING = {'chs', 'abducible', 'global_constraint', 'global_constraints', 'o_nmr_check'}
+
+def newProof():
+    """An empty proof DAG. 'nodes' holds (conclusion, premise node indices),
+       where the conclusion is a GF expression or a string, 'index' maps
+       structural keys to node indices, and 'exprs' caches the converted
+       conclusions.
+    """
+    return {'nodes': [], 'index': {}, 'exprs': {}}
+
+def splitReason(reason):
+    """Returns the statement and the premises of a reason from the parser,
+       or (None, []) for bookkeeping reasons.
+    """
+    if 'implication reason' in reason:
+        impl = reason['implication reason'][0]
+        stmt, premises = impl['implication conclusion'], impl['list of reasons']
+    elif 'term reason' in reason:
+        stmt, premises = reason['term reason'], []
+    else:
+        raise Exception("splitReason: expected implication or term reason, got " + yaml.dump(reason))
+    if 'term' in stmt and stmt['term']['functor'].get('base atom') in PROOF_BOOKKEEPING:
+        return None, []
+    return stmt, premises
+
+def symbol2text(symbol):
+    if 'variable' in symbol:
+        return symbol['variable']
+    return symbol['term']['functor']['base atom']
+
+def stmt2conclusion(stmt):
+    """Converts a statement from the parser into a GF expression,
+       or into text if the grammar can't express it.
+    """
+    if 'negation as failure' in stmt:
+        return "there is no evidence that " + conclusion2text(stmt2conclusion(stmt['negation as failure']))
+    if 'operator' in stmt:
+        op = "is not" if 'disequality' in stmt['operator'] else "is"
+        return ' '.join([symbol2text(stmt['left side']), op, symbol2text(stmt['right side'])])
+    if 'term' in stmt:
+        if 'arguments' not in stmt['term']:
+            return stmt['term']['functor']['base atom'].replace('_', ' ')
+        return term2exp(stmt['term'])
+    raise Exception("stmt2conclusion: expected a term, negation or constraint, got instead " + yaml.dump(stmt))
+
+def conclusion2text(concl):
+    return concl if isinstance(concl, str) else prettyLin(concl)
+
+def reason2node(reason, proof):
+    """Adds the sub-proofs of reason to proof. Returns the index of its node,
+       or None if it is bookkeeping.
+    """
+    nodes, index, exprs = proof['nodes'], proof['index'], proof['exprs']
+    results = []
+    stack = [(reason, False)]
+    while stack:
+        r, premisesDone = stack.pop()
+        stmt, premises = splitReason(r)
+        if stmt is None:
+            results.append(None)
+        elif not premisesDone:
+            stack.append((r, True))
+            stack.extend((p, False) for p in reversed(premises))
+        else:
+            children = results[len(results)-len(premises):]
+            del results[len(results)-len(premises):]
+            stmtKey = json.dumps(stmt, sort_keys=True)
+            key = (stmtKey, tuple(c for c in children if c is not None))
+            i = index.get(key)
+            if i is None:
+                if stmtKey not in exprs:
+                    exprs[stmtKey] = stmt2conclusion(stmt)
+                i = index[key] = len(nodes)
+                nodes.append((exprs[stmtKey], list(key[1])))
+            results.append(i)
+    return results[0]
+
+def justification2proof(reasons, proof=None):
+    """Converts a justification (list of reasons) into nodes of proof.
+       Returns the indices of the top-level nodes, and the proof.
+    """
+    if proof is None:
+        proof = newProof()
+    roots = [reason2node(r, proof) for r in reasons]
+    return [i for i in roots if i is not None], proof
+
+def parseProofs(responsetext):
+    """Returns one proof DAG shared by all answers of the response,
+       and for each answer, the indices of its top-level nodes.
+    """
+    resp = rp.parse_deep(rp.response, responsetext)
+    proof = newProof()
+    roots = [justification2proof(ans.get('justification', []), proof)[0]
+             for ans in resp['answer set']]
+    return roots, proof
+
+def nlgProof(roots, proof):
+    """Explains every distinct sub-proof reachable from roots once,
+       as a numbered block. Premises that have a proof of their own
+       refer to the number of its block.
+    """
+    nodes = proof['nodes']
+    numbers = {}
+    order = []
+    stack = list(reversed(roots))
+    while stack:
+        i = stack.pop()
+        if i in numbers or not nodes[i][1]:
+            continue
+        numbers[i] = len(order) + 1
+        order.append(i)
+        stack.extend(reversed(nodes[i][1]))
+
+    result = []
+    for i in roots:
+        if i not in numbers:
+            result.append(conclusion2text(nodes[i][0]))
+    for i in order:
+        concl, premises = nodes[i]
+        result.append("\n[%d] %s" % (numbers[i], linImplication(concl, [nodes[p][0] for p in premises])))
+        refs = ["[%d]" % numbers[p] for p in premises if p in numbers]
+        if refs:
+            result.append("(see " + ', '.join(refs) + ")")
     return '\n'.join(result)
 
+def linImplication(concl, premises):
+    """Linearises "concl if premises", through the grammar when it can
+       express all of them, and in the same layout otherwise.
+    """
+    if not isinstance(concl, str) and not any(isinstance(p, str) for p in premises):
+        if len(premises)==1:
+            body = premises[0]
+        else:
+            body = wrapStatement(R.Bullets, premises)
+        return prettyLin(R.IfThen(concl, body))
+    texts = [conclusion2text(p) for p in premises]
+    if len(texts)==1:
+        return conclusion2text(concl) + " if " + texts[0]
+    return conclusion2text(concl) + " if\n" + ",\n".join("* " + t for t in texts[:-1]) + " and\n* " + texts[-1]
+
 #### Finally, test aggregation on parsed models
 
 if __name__=="__main__":
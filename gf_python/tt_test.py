@@ -41,13 +41,20 @@ aPaper_cRock = [
    "paper beats rock",
 ]
 
+# The grammar is ambiguous: a sentence also parses with the App1/App2 and
+# AggregateSubj1/2 shortcuts, which treetransform never produces. Take the
+# most probable parse that has the same shape as the trees from parseModels.
+SIMPLE_FUNS = ["App", "AggregateSubj", "AggregatePred"]
+
 def getExpr(sentence):
     try:
         i = tt.eng.parse(sentence)
     except Exception:
         raise Exception("getExpr: sentence not parsed: " + sentence)
-    prob,expr = next(i)
-    return expr
+    for prob,expr in i:
+        if expr.unpack()[0] in SIMPLE_FUNS:
+            return expr
+    raise Exception("getExpr: no simple parse for sentence: " + sentence)
 
 testCorpus = [aRock_cScissors, aScissors_cPaper, aPaper_cRock]
 
@@ -112,3 +119,226 @@ aRock_cScissors_gold = """A wins RPS if
 aRock_cScissors_system = nlgSingleModel(parsedTestCorpus[0])
 
 assert aRock_cScissors_system == aRock_cScissors_gold
+
+#### Clustering large answer sets
+
+parsedResponseModels = tt.parseModels(tt.responsetext)
+atomSets, atoms = tt.internAtoms([m[1:] for m in parsedResponseModels*3])
+assert len(atoms) == 14 # 5 shared atoms, 3 distinct ones in every model
+
+clusters = tt.clusterAtomSets(atomSets, maxClusters=2)
+assert len(clusters) <= 2
+assert sorted(i for c in clusters for i in c) == list(range(9))
+
+clusteredShared = """A wins RPS,
+
+if all of the following hold:
+
+* RPS is a game and
+* A and C are players and participants in RPS
+
+and one of the following holds:
+"""
+
+# One cluster per model: each case is that model's own evidence
+threeClusters = tt.nlgModelsClustered(parsedResponseModels, 3)
+assert threeClusters.startswith(clusteredShared)
+assert """case 2 (answers 2):
+
+* scissors beats paper,
+* A throws scissors and
+* C throws paper""" in threeClusters
+
+# The cap merges models with nothing in common beyond the shared evidence,
+# so the case lists the evidence of each member
+oneCluster = tt.nlgModelsClustered(parsedResponseModels, 1)
+assert oneCluster == clusteredShared + """
+case 1 (answers 1, 2, 3):
+* answer 1: rock beats scissors, A throws rock and C throws scissors
+* answer 2: scissors beats paper, A throws scissors and C throws paper
+* answer 3: paper beats rock, A throws paper and C throws rock"""
+
+# Thousands of dissimilar models: every case stays a few lines long
+import time
+def syntheticModels(n):
+    def atom(a):
+        return tt.pgf.readExpr(a)
+    def app(pred, subj, obj=None):
+        if obj is None:
+            return R.App(R.IntransPred(atom(pred)), subj)
+        return R.App(R.TransPred(atom(pred), obj), subj)
+    def var(v):
+        return R.AVar(R.V(atom('"%s"' % v)))
+    signs = [R.AAtom(atom(s)) for s in ["rock", "paper", "scissors"]]
+    return [[app("win", var("A"), var("RPS")),
+             app("is_game", var("RPS")),
+             app("is_player", var("P%d" % (i % 97))),
+             app("throw", var("P%d" % (i % 89)), signs[i % 3]),
+             app("is_participant_in", var("P%d" % (i % 83)), var("RPS"))]
+            for i in range(n)]
+
+manyModels = syntheticModels(3000)
+start = time.perf_counter()
+manyClusters = tt.nlgModelsClustered(manyModels, 8)
+assert time.perf_counter() - start < 10
+maxCaseLines = 4 + tt.CLUSTER_TOP_ATOMS + tt.CLUSTER_EXAMPLES + 1
+assert len(manyClusters.splitlines()) <= 10 + 8*maxCaseLines
+assert "and 2494 other answers" in manyClusters
+
+#### Reading responses from files
+
+assert list(tt.parseModelsFile(tt.localFile('test-model.txt'))) == parsedResponseModels
+
+#### Caching aggregateAll
+
+tt.clearAggregateCache()
+firstRun = tt.nlgModels(parsedResponseModels)
+misses = tt.aggregateCacheInfo()['misses']
+reversedModels = [[m[0]] + list(reversed(m[1:])) for m in parsedResponseModels]
+assert tt.nlgModels(reversedModels) == firstRun
+assert tt.aggregateCacheInfo()['misses'] == misses
+assert tt.aggregateCacheInfo()['hits'] == misses
+
+#### Proofs from justifications
+
+proofRoots, proof = tt.parseProofs(tt.responsetext)
+assert len(proofRoots) == 3
+assert proofRoots[0] == proofRoots[1] == proofRoots[2] # the answers share their proof
+assert len(proof['nodes']) == 1 # global_constraint is left out
+
+# The premise chain of is_participant_in(A,RPS) is shared, o_nmr_check is
+# left out, and the grammar can't express negation or constraints
+proofResponse = """QUERY:?- win(A,RPS).
+
+        ANSWER: 1 (in 0.091 ms)
+
+JUSTIFICATION_TREE:
+win(A,RPS) :-
+    is_player(A) :-
+        is_participant_in(A,RPS) :-
+            is_game(RPS).
+    is_player(C) :-
+        is_participant_in(A,RPS) :-
+            is_game(RPS).
+    not beat(scissors,rock) :-
+        not throw(C,scissors).
+    A \\= C :-
+        is_player(A),
+        is_player(C).
+o_nmr_check :-
+    not win(C,RPS).
+global_constraint.
+
+MODEL:
+{ win(A,RPS) }
+
+BINDINGS:
+"""
+
+proofRoots, proof = tt.parseProofs(tt.rp.annotate_indents(proofResponse))
+assert len(proofRoots) == 1 and len(proofRoots[0]) == 1
+assert len(proof['nodes']) == 10
+assert tt.nlgProof(proofRoots[0], proof) == """
+[1] A wins RPS if
+* A is a player,
+* C is a player,
+* there is no evidence that scissors beats rock and
+* A is not C
+(see [2], [4], [5], [6])
+
+[2] A is a player if A is a participant in RPS
+(see [3])
+
+[3] A is a participant in RPS if RPS is a game
+
+[4] C is a player if A is a participant in RPS
+(see [3])
+
+[5] there is no evidence that scissors beats rock if there is no evidence that C throws scissors
+
+[6] A is not C if
+* A is a player and
+* C is a player"""
+
+#### Streaming output
+
+events = list(tt.iterNlgModels(parsedResponseModels))
+assert [ev['event'] for ev in events] == ['conclusion', 'shared', 'unique', 'unique', 'unique']
+assert [ev['answers'] for ev in events[2:]] == [[1], [2], [3]]
+assert events[1]['text'] in tt.nlgModels(parsedResponseModels)
+
+import json
+jsonEvents = [json.loads(l) for l in tt.eventsToJsonLines(events)]
+assert [ev['id'] for ev in jsonEvents] == [ev['id'] for ev in events]
+assert jsonEvents[0]['tree'] == tt.show(events[0]['tree'])
+
+#### Budgets
+
+from gf_python.budget import Budget
+rawResponse = open(tt.localFile('test-model.txt'), 'r').read()
+
+unlimited = tt.nlgModelsBudgeted(rawResponse, Budget())
+assert unlimited['text'] == tt.nlgModels(parsedResponseModels)
+assert unlimited['answers'] == [1, 2, 3] and not unlimited['truncated']
+
+twoAnswers = tt.nlgModelsBudgeted(rawResponse, Budget(maxAnswers=2))
+assert twoAnswers['answers'] == [1, 2]
+assert twoAnswers['truncated'] and twoAnswers['reasons'] == ['answers']
+
+noTime = tt.nlgModelsBudgeted(rawResponse, Budget(seconds=0))
+assert noTime['answers'] == [] and noTime['reasons'] == ['deadline']
+
+# Clipped models can leave no unique evidence, or a single statement
+twoAtoms = tt.nlgModelsBudgeted(rawResponse, Budget(maxAtoms=2))
+assert twoAtoms['answers'] == [1, 2, 3] and twoAtoms['reasons'] == ['atoms']
+assert twoAtoms['text'] == """A wins RPS,
+
+if all of the following hold:
+RPS is a game"""
+
+threeAtoms = tt.nlgModelsBudgeted(rawResponse, Budget(maxAtoms=3))
+assert threeAtoms['text'] == """A wins RPS,
+
+if all of the following hold:
+
+* A is a participant in RPS and
+* RPS is a game"""
+
+sixAtoms = tt.nlgModelsBudgeted(rawResponse, Budget(maxAtoms=6))
+assert sixAtoms['text'] == """A wins RPS,
+
+if all of the following hold:
+
+* A is a participant in RPS,
+* RPS is a game and
+* A and C are players
+
+and one of the following holds:
+
+* A throws rock,
+* A throws scissors or
+* A throws paper"""
+
+# A malformed answer ends the explanation, the answers before it are kept
+brokenResponse = rawResponse.replace("throw(A,scissors)", "throw(A,scissors", 1)
+malformed = tt.nlgModelsBudgeted(brokenResponse, Budget())
+assert malformed['answers'] == [1]
+assert malformed['truncated'] and malformed['reasons'] == ['malformed']
+assert [e['answer number'] for e in malformed['errors']] == ['2']
+assert malformed['text'] == tt.nlgModels(parsedResponseModels[:1])
+
+# The header and responses without answers are checked too
+garbage = "not an s(CASP) response " * 70000
+tooLong = tt.nlgModelsBudgeted(garbage, Budget(maxBytes=100))
+assert tooLong['answers'] == [] and tooLong['reasons'] == ['bytes']
+badHeader = tt.nlgModelsBudgeted(garbage, Budget())
+assert badHeader['answers'] == [] and badHeader['reasons'] == ['malformed']
+assert badHeader['errors'][0]['answer number'] is None
+
+# The conclusion is always kept
+try:
+    Budget(maxAtoms=0)
+except Exception as err:
+    assert "maxAtoms" in str(err)
+else:
+    assert False, "expected an error for maxAtoms=0"
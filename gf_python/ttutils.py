@@ -51,13 +51,11 @@ def showExprs(es):
 def listGeneric(args, basefun, consfun):
     if len(args)<2:
         raise Exception("listArg: too short list", args)
-    elif len(args)==2:
-        a, b = args
-        return basefun(a,b)
-    else:
-        a = args[0]
-        rest = args[1:]
-        return consfun(a, listGeneric(rest, basefun, consfun))
+    # Build the list from the end, so that long lists don't hit the recursion limit
+    result = basefun(args[-2], args[-1])
+    for a in reversed(args[:-2]):
+        result = consfun(a, result)
+    return result
 
 
 def unListGeneric(expr, basefStr, consfStr):
@@ -12,4 +12,7 @@ setup(name='gf_python',
           'pyyaml',
           'pyparsing'
           ],
+      entry_points={
+          'console_scripts': ['gf-nlg=gf_python.nlgserver:main'],
+      },
       zip_safe=False)